@@ -4,9 +4,7 @@ from . import Graph, operations
 def word_count_graph(input_stream_name: str, text_column: str = 'text', count_column: str = 'count') -> Graph:
     """Construct graph  which counts words in text_column of all rows passed"""
     return Graph.graph_from_iter(input_stream_name) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column)) \
+        .map(operations.Tokenize(text_column)) \
         .sort([text_column]) \
         .reduce(operations.Count(count_column), [text_column]) \
         .sort([count_column, text_column])
@@ -15,30 +13,29 @@ def word_count_graph(input_stream_name: str, text_column: str = 'text', count_co
 def inverted_index_graph(input_stream_name: str, doc_column: str = 'doc_id', text_column: str = 'text',
                          result_column: str = 'tf_idf') -> Graph:
     """Constructs graph which calculates td-idf for every word/document pair"""
+    # every document yields at least one word (an empty one for text without words), so n_docs could be counted
+    # from words too, but that would tokenize all texts once more, while projecting doc_column is much cheaper
     number_of_docs = Graph.graph_from_iter(input_stream_name) \
         .map(operations.Project([doc_column])) \
         .reduce(operations.CountUnique(doc_column, 'n_docs'), [])
 
     words = Graph.graph_from_iter(input_stream_name) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column))
+        .map(operations.Tokenize(text_column))
 
     frequency = words.sort([doc_column]) \
         .reduce(operations.TermFrequency(text_column, 'freq'), [doc_column]) \
         .sort([text_column])
 
     presence_in_docs = words.sort([text_column]) \
-        .reduce(operations.CountUnique(doc_column, 'presence_in_docs'), [text_column]) \
-        .sort([text_column])
+        .reduce(operations.CountUnique(doc_column, 'presence_in_docs'), [text_column])
 
-    graph = number_of_docs.join(operations.InnerJoiner(), frequency, []) \
+    # join by text keeps rows sorted by text, so no sort is needed before TopN
+    graph = frequency.broadcast(number_of_docs) \
         .join(operations.InnerJoiner(), presence_in_docs, [text_column]) \
         .map(operations.Divide(nominator='n_docs', denominator='presence_in_docs', result='fraction')) \
         .map(operations.Log('fraction', 'log')) \
         .map(operations.Product(['freq', 'log'], result_column=result_column)) \
-        .map(operations.Project([doc_column, text_column, result_column])) \
-        .sort([text_column]) \
+        .map(operations.Project([doc_column, text_column, result_column], inplace=True)) \
         .reduce(operations.TopN(result_column, 3), [text_column])
 
     return graph
@@ -48,18 +45,10 @@ def pmi_graph(input_stream_name: str, doc_column: str = 'doc_id', text_column: s
               result_column: str = 'pmi') -> Graph:
     """Constructs graph which gives for every document the top 10 words ranked by pointwise mutual information"""
     words = Graph.graph_from_iter(input_stream_name) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column)) \
-        .map(operations.Filter(lambda row: len(row[text_column]) > 4)) \
+        .map(operations.Tokenize(text_column, min_length=5)) \
         .sort([doc_column, text_column])
 
-    filtered = words.sort([doc_column, text_column]) \
-        .reduce(operations.Count('count'), [doc_column, text_column]) \
-        .map(operations.Filter(lambda row: row['count'] >= 2)) \
-        .map(operations.Project([doc_column, text_column])) \
-
-    filtered = filtered.join(operations.InnerJoiner(), words, [doc_column, text_column]) \
+    filtered = words.reduce(operations.FilterByGroupCount(2), [doc_column, text_column])
 
     frequency = filtered.reduce(operations.TermFrequency(text_column, 'freq'), [doc_column])\
         .sort([text_column])
@@ -70,7 +59,7 @@ def pmi_graph(input_stream_name: str, doc_column: str = 'doc_id', text_column: s
     graph = frequency.join(operations.InnerJoiner(), frequency_all, [text_column])\
         .map(operations.Divide(nominator='freq', denominator='freq_all', result='fraq'))\
         .map(operations.Log(arg='fraq', result=result_column)) \
-        .map(operations.Project([doc_column, text_column, result_column])) \
+        .map(operations.Project([doc_column, text_column, result_column], inplace=True)) \
         .sort([doc_column, result_column, text_column]) \
         .reduce(operations.TopN(result_column, 10), [doc_column])
 
@@ -1,21 +1,97 @@
+import heapq
+import pickle
+import sys
+import tempfile
 import typing as tp
 
+from itertools import islice
 from multiprocessing import Pipe, Process, connection
 from operator import itemgetter
+from os import environ
 
 from . import operations as ops
 
+BATCH_SIZE = int(environ.get("SORT_BATCH_SIZE", "1024"))  # rows sent through the pipe at once
+RUN_SIZE = int(environ.get("SORT_RUN_SIZE", "1000000"))  # rows sorted in memory before spilling to disk
+KEYS_SAMPLE_SIZE = 1024  # rows looked at to decide whether keys repeat enough for bucket sort
 
-def do_sort(endpoint: connection.Connection, keys: tp.Tuple[str, ...]) -> None:
-    rows = []
+
+def _sort_rows(rows: tp.List[ops.TRow], key: tp.Callable[[ops.TRow], tp.Any]) -> tp.List[ops.TRow]:
+    """
+    Stable sort of rows by key. When keys repeat a lot (e.g. words of a text), rows are put into buckets
+    by key in one pass and only distinct keys are sorted, otherwise list.sort is used
+    """
+    sample = rows[:KEYS_SAMPLE_SIZE]
+    try:
+        n_distinct = len(set(map(key, sample)))
+    except TypeError:  # unhashable keys
+        n_distinct = len(sample)
+    if n_distinct * 4 > len(sample):
+        rows.sort(key=key)
+        return rows
+
+    buckets: tp.Dict[tp.Any, tp.List[ops.TRow]] = {}
+    for row, row_key in zip(rows, map(key, rows)):
+        bucket = buckets.get(row_key)
+        if bucket is None:
+            buckets[row_key] = [row]
+        else:
+            bucket.append(row)
+
+    result: tp.List[ops.TRow] = []
+    for row_key in sorted(buckets):
+        result.extend(buckets[row_key])
+    return result
+
+
+def _write_run(rows: tp.List[ops.TRow]) -> tp.IO[bytes]:
+    """Write sorted rows to a temporary file in batches"""
+    file = tempfile.TemporaryFile()
+    for start in range(0, len(rows), BATCH_SIZE):
+        pickle.dump(rows[start:start + BATCH_SIZE], file, pickle.HIGHEST_PROTOCOL)
+    file.seek(0)
+    return file
+
+
+def _read_run(file: tp.IO[bytes]) -> ops.TRowsGenerator:
+    """Read rows written by _write_run, closing the file at the end"""
+    with file:
+        while True:
+            try:
+                batch = pickle.load(file)
+            except EOFError:
+                return
+            yield from batch
+
+
+def do_sort(endpoint: connection.Connection, key: tp.Callable[[ops.TRow], tp.Any], run_size: int = RUN_SIZE) -> None:
+    """
+    Receive rows, sort them and send them back. Every run_size rows are sorted and spilled to a temporary file,
+    then the runs are merged, so at most run_size rows are kept in memory besides one batch per run
+    """
+    rows: tp.List[ops.TRow] = []
+    runs: tp.List[tp.IO[bytes]] = []
     while True:
-        row = endpoint.recv()
-        if row is None:
+        batch = endpoint.recv()
+        if batch is None:
             break
-        rows.append(row)
-    rows.sort(key=itemgetter(*keys))
-    for row in rows:
-        endpoint.send(row)
+        rows.extend(batch)
+        if len(rows) >= run_size:
+            runs.append(_write_run(_sort_rows(rows, key)))
+            rows = []
+    rows = _sort_rows(rows, key)
+
+    if runs:
+        # runs go in the order rows were received, heapq.merge keeps equal rows in that order
+        merged = heapq.merge(*map(_read_run, runs), iter(rows), key=key)
+        while True:
+            batch = list(islice(merged, BATCH_SIZE))
+            if not batch:
+                break
+            endpoint.send(batch)
+    else:
+        for start in range(0, len(rows), BATCH_SIZE):
+            endpoint.send(rows[start:start + BATCH_SIZE])
     endpoint.send(None)
 
 
@@ -24,26 +100,41 @@ class ExternalSort(ops.Operation):
     In order to not account materialization during sorting in main process memory consumption, we delegate
     sorting to a separate process.
     This class illustrates cross-process streaming.
+    Rows are sent through the pipe in batches, so every message is pickled and transferred once per batch
+    instead of once per row.
     """
 
-    def __init__(self, keys: tp.Sequence[str]):
-        self.keys = keys
+    def __init__(self, keys: tp.Sequence[str], run_size: int = RUN_SIZE):
+        """
+        :param keys: sorting keys
+        :param run_size: number of rows sorted in memory, larger inputs are merged from runs spilled to disk
+        """
+        self.keys = tuple(map(sys.intern, keys))
+        self.run_size = run_size
+        self._key = itemgetter(*self.keys)
 
     def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
         local_endpoint, remote_endpoint = Pipe()
-        process = Process(target=do_sort, args=(remote_endpoint, self.keys))
+        process = Process(target=do_sort, args=(remote_endpoint, self._key, self.run_size))
         process.start()
         row_count_before = 0
+        batch: tp.List[ops.TRow] = []
         for row in rows:
-            local_endpoint.send(row)
-            row_count_before += 1
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                local_endpoint.send(batch)
+                row_count_before += len(batch)
+                batch = []
+        if batch:
+            local_endpoint.send(batch)
+            row_count_before += len(batch)
         local_endpoint.send(None)
         row_count_after = 0
         while True:
-            local_endpoint_row = local_endpoint.recv()
-            if local_endpoint_row is None:
+            local_endpoint_batch = local_endpoint.recv()
+            if local_endpoint_batch is None:
                 break
-            yield local_endpoint_row
-            row_count_after += 1
+            yield from local_endpoint_batch
+            row_count_after += len(local_endpoint_batch)
         assert row_count_before == row_count_after
         process.join()
@@ -1,7 +1,73 @@
+import os
 import typing as tp
 
+from collections import OrderedDict
+from functools import partial
+from multiprocessing import connection, context, get_context
+from os import environ
+
 from . import operations as ops
-from .external_sort import ExternalSort
+from .external_sort import BATCH_SIZE, RUN_SIZE, ExternalSort
+
+# kwarg passed down the pipeline by Graph.run_parallel
+_PARALLEL = '_parallel'
+
+# graphs and data source factories (often lambdas) can't be pickled, so branch processes are forked
+_FORK_CONTEXT: tp.Optional[context.ForkContext]
+try:
+    _FORK_CONTEXT = get_context('fork')
+except ValueError:  # no fork on the platform (e.g. Windows), Graph.run_parallel runs branches serially
+    _FORK_CONTEXT = None
+
+FILE_CACHE_SIZE = int(environ.get("GRAPH_FILE_CACHE_SIZE", "4"))  # files kept parsed for graph_from_file(cache=True)
+
+# cached file reading operations shared by graphs, by absolute file path and parser, least recently used first
+_FILE_CACHES: 'OrderedDict[tp.Tuple[str, tp.Callable[[str], ops.TRow]], Graph.CacheGraph]' = OrderedDict()
+
+
+def _send_rows(endpoint: connection.Connection, graph: 'Graph', kwargs: tp.Dict[str, tp.Any]) -> None:
+    batch: tp.List[ops.TRow] = []
+    for row in graph.run(**kwargs):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            endpoint.send(batch)
+            batch = []
+    if batch:
+        endpoint.send(batch)
+    endpoint.send(None)
+
+
+def _run_in_process(graph: 'Graph', kwargs: tp.Dict[str, tp.Any]) -> ops.TRowsIterable:
+    """
+    Start running graph in a separate process right away and get iterable of its resulting rows,
+    so the graph is computed concurrently with the work done by the current process.
+    Where processes can't be forked the graph is run in the current process when its rows are read
+    """
+    if _FORK_CONTEXT is None:
+        return graph.run(**kwargs)
+
+    local_endpoint, remote_endpoint = _FORK_CONTEXT.Pipe()
+    process = _FORK_CONTEXT.Process(target=_send_rows, args=(remote_endpoint, graph, kwargs))
+    process.start()
+    remote_endpoint.close()
+
+    def receive() -> ops.TRowsGenerator:
+        try:
+            while True:
+                try:
+                    batch = local_endpoint.recv()
+                except EOFError:
+                    raise RuntimeError('Graph branch process exited without sending all rows')
+                if batch is None:
+                    break
+                yield from batch
+            process.join()
+        finally:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    return receive()
 
 
 class Graph:
@@ -19,18 +85,35 @@ class Graph:
         return Graph(ops.ReadIterFactory(name))
 
     @staticmethod
-    def graph_from_file(filename: str, parser: tp.Callable[[str], ops.TRow]) -> 'Graph':
+    def graph_from_file(filename: str, parser: tp.Callable[[str], ops.TRow], cache: bool = False) -> 'Graph':
         """Construct new graph extended with operation for reading rows from file
         Use ops.Read
         :param filename: filename to read from
         :param parser: parser from string to Row
+        :param cache: parse the file once for all graphs reading it with the same parser,
+            it is parsed again when its modification time changes. Only FILE_CACHE_SIZE recently read files
+            are kept, see also clear_file_cache
         """
-        return Graph(ops.Read(filename, parser))
+        if not cache:
+            return Graph(ops.Read(filename, parser))
+        return Graph(Graph.ReadCachedFile(filename, parser))
+
+    @staticmethod
+    def clear_file_cache() -> None:
+        """Drop rows of all files cached by graph_from_file"""
+        _FILE_CACHES.clear()
 
     def map(self, mapper: ops.Mapper) -> 'Graph':
-        """Construct new graph extended with map operation with particular mapper
+        """Construct new graph extended with map operation with particular mapper.
+        Mappers supporting batch processing are run over batches of rows,
+        row mappers are run without creating a generator per row
+        (unless a subclass changed what the mapper does per row leaving these methods as they were)
         :param mapper: mapper to use
         """
+        if isinstance(mapper, ops.BatchMapper) and ops.BatchMap.accepts(mapper):
+            return Graph(self.AppendOperation(ops.BatchMap(mapper), self.pipeline))
+        if isinstance(mapper, ops.RowMapper) and ops.MapOne.accepts(mapper):
+            return Graph(self.AppendOperation(ops.MapOne(mapper), self.pipeline))
         return Graph(self.AppendOperation(ops.Map(mapper), self.pipeline))
 
     def reduce(self, reducer: ops.Reducer, keys: tp.Sequence[str]) -> 'Graph':
@@ -40,11 +123,22 @@ class Graph:
         """
         return Graph(self.AppendOperation(ops.Reduce(reducer, keys), self.pipeline))
 
-    def sort(self, keys: tp.Sequence[str]) -> 'Graph':
+    def hash_reduce(self, reducer: ops.Reducer, keys: tp.Sequence[str]) -> 'Graph':
+        """Construct new graph extended with reduce operation which does not need rows sorted by keys.
+        Reducers supporting hash aggregation keep only aggregated values of groups in memory,
+        otherwise or when keys are mostly distinct rows are sorted (with spilling to disk) and reduced
+        :param reducer: reducer to use
+        :param keys: keys for grouping
+        """
+        sort = ExternalSort(keys) if keys else None
+        return Graph(self.AppendOperation(ops.HashReduce(reducer, keys, sort=sort), self.pipeline))
+
+    def sort(self, keys: tp.Sequence[str], run_size: int = RUN_SIZE) -> 'Graph':
         """Construct new graph extended with sort operation
         :param keys: sorting keys (typical is tuple of strings)
+        :param run_size: number of rows sorted in memory, larger inputs are sorted in runs spilled to disk and merged
         """
-        return Graph(self.AppendOperation(ExternalSort(keys), self.pipeline))
+        return Graph(self.AppendOperation(ExternalSort(keys, run_size), self.pipeline))
 
     def join(self, joiner: ops.Joiner, join_graph: 'Graph', keys: tp.Sequence[str]) -> 'Graph':
         """Construct new graph extended with join operation with another graph
@@ -54,10 +148,31 @@ class Graph:
         """
         return Graph(self.JoinGraphs(ops.Join(joiner, keys), self, join_graph))
 
+    def broadcast(self, broadcast_graph: 'Graph') -> 'Graph':
+        """Construct new graph where every row is extended with columns of the row computed by another graph.
+        Use it instead of join by empty keys when another graph yields a single row (e.g. a global aggregate):
+        the row is computed first and then added to every row by a cheap map
+        :param broadcast_graph: graph yielding the row to broadcast
+        """
+        return Graph(self.BroadcastGraphs(self, broadcast_graph))
+
+    def cache(self) -> 'Graph':
+        """Construct new graph which computes rows of this graph once and replays them on every further run.
+        Use it when several branches start from the same expensive node (e.g. reading and parsing a file),
+        rows exceeding the in-memory limit are kept in a temporary file.
+        Note that cached rows are reused even if the graph is run with other kwargs
+        """
+        return Graph(self.CacheGraph(self))
+
     def run(self, **kwargs: tp.Any) -> ops.TRowsIterable:
         """Single method to start execution; data sources passed as kwargs"""
         yield from self.pipeline(**kwargs)
 
+    def run_parallel(self, **kwargs: tp.Any) -> ops.TRowsIterable:
+        """Same as run, but independent branches are computed in separate processes concurrently:
+        the second graph of every join and the main graph of every broadcast"""
+        yield from self.pipeline(**{**kwargs, _PARALLEL: True})
+
     class AppendOperation(ops.Operation):
         """
         Make composition of two operations
@@ -79,6 +194,75 @@ class Graph:
             self.graph_two = graph_two
 
         def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+            if kwargs.get(_PARALLEL):
+                dataflow_two = _run_in_process(self.graph_two, kwargs)
+            else:
+                dataflow_two = self.graph_two.run(**kwargs)
             dataflow_one = self.graph_one.run(**kwargs)
-            dataflow_two = self.graph_two.run(**kwargs)
             yield from self.join(dataflow_one, dataflow_two)
+
+    class BroadcastGraphs(ops.Operation):
+        """
+        Implements broadcasting of one graph's single row result over another graph's dataflow
+        """
+        def __init__(self, graph: 'Graph', broadcast_graph: 'Graph') -> None:
+            self.graph = graph
+            self.broadcast_graph = broadcast_graph
+
+        def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+            dataflow: tp.Optional[ops.TRowsIterable] = None
+            if kwargs.get(_PARALLEL):
+                # main graph is computed while the broadcast row is being computed here
+                dataflow = _run_in_process(self.graph, kwargs)
+
+            constants: ops.TRow = {}
+            for row in self.broadcast_graph.run(**kwargs):
+                constants.update(row)
+
+            if dataflow is None:
+                dataflow = self.graph.run(**kwargs)
+            for column, value in constants.items():
+                dataflow = ops.BatchMap(ops.BroadcastConstant(column, value))(dataflow)
+            yield from dataflow
+
+    class CacheGraph(ops.Operation):
+        """
+        Implements computing graph's dataflow once and storing it for further runs
+        """
+        def __init__(self, graph: 'Graph', version: tp.Callable[[], tp.Any] = lambda: None) -> None:
+            """
+            :param graph: graph to cache
+            :param version: rows are computed again when the value returned by version changes
+            """
+            self.graph = graph
+            self.version = version
+            self.rows: tp.Optional[ops.SpilledRows] = None
+            self.rows_version: tp.Any = None
+
+        def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+            version = self.version()
+            if self.rows is None or version != self.rows_version:
+                self.rows = ops.SpilledRows(self.graph.run(**kwargs))
+                self.rows_version = version
+            # mappers modify rows inplace, so every run gets its own copies
+            yield from map(dict.copy, self.rows)
+
+    class ReadCachedFile(ops.Operation):
+        """
+        Implements reading file through the cache shared by all graphs reading it
+        """
+        def __init__(self, filename: str, parser: tp.Callable[[str], ops.TRow]) -> None:
+            self.path = os.path.abspath(filename)
+            self.parser = parser
+
+        def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+            key = (self.path, self.parser)
+            cache_op = _FILE_CACHES.get(key)
+            if cache_op is None:
+                cache_op = _FILE_CACHES[key] = Graph.CacheGraph(Graph(ops.Read(self.path, self.parser)),
+                                                                version=partial(os.path.getmtime, self.path))
+                while len(_FILE_CACHES) > FILE_CACHE_SIZE:
+                    _FILE_CACHES.popitem(last=False)
+            else:
+                _FILE_CACHES.move_to_end(key)
+            yield from cache_op(**kwargs)
@@ -1,18 +1,28 @@
-import copy
 import heapq
+import os
+import pickle
 import re
+import sys
+import tempfile
 import typing as tp
+import weakref
 
 from abc import abstractmethod, ABC
-from datetime import datetime
-from itertools import groupby
-from math import radians, cos, sin, asin, sqrt, log
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from itertools import chain, groupby, islice
+from math import cos, sin, asin, sqrt, log, pi, prod
+from operator import itemgetter, mul, truediv
 
 
 TRow = tp.Dict[str, tp.Any]
 TRowsIterable = tp.Iterable[TRow]
 TRowsGenerator = tp.Generator[TRow, None, None]
 
+_PUNCT_RE = re.compile(r"[^\s\w]|_")
+# Deletion table with every ASCII character matched by _PUNCT_RE, so pure-ASCII strings skip the regex engine
+_ASCII_PUNCT_TBL = str.maketrans('', '', ''.join(c for c in map(chr, range(128)) if _PUNCT_RE.match(c)))
+
 
 class Operation(ABC):
     @abstractmethod
@@ -43,6 +53,39 @@ class ReadIterFactory(Operation):
 # Operations
 
 
+def _intern_columns(columns: tp.Sequence[str]) -> tp.Tuple[str, ...]:
+    """
+    Intern column names, so row dicts built with them share key objects and lookups compare keys by identity
+    :param columns: column names
+    """
+    return tuple(map(sys.intern, columns))
+
+
+def _key_getter(keys: tp.Sequence[str]) -> tp.Callable[[TRow], tp.Any]:
+    """
+    Get function extracting values of keys from row. For a single key the value itself is returned,
+    which groups and compares the same way as one element tuple
+    :param keys: key columns
+    """
+    if not keys:
+        return lambda row: ()
+    return itemgetter(*keys)
+
+
+def _defined_below(obj: tp.Any, method: str, *others: str) -> bool:
+    """
+    Check that method of obj is defined by the class defining each of others methods or by its subclass,
+    so a subclass did not override one of others leaving method to do what the parent class did
+    :param obj: object to check
+    :param method: name of method used in place of others
+    :param others: names of methods method has to agree with
+    """
+    def owner(name: str) -> type:
+        return next(cls for cls in type(obj).__mro__ if name in vars(cls))
+
+    return all(issubclass(owner(method), owner(other)) for other in others)
+
+
 class Mapper(ABC):
     """Base class for mappers"""
     @abstractmethod
@@ -58,8 +101,81 @@ class Map(Operation):
         self.mapper = mapper
 
     def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
-        for row in rows:
-            yield from self.mapper(row)
+        yield from chain.from_iterable(map(self.mapper, rows))
+
+
+class RowMapper(Mapper):
+    """Base class for mappers which turn every row into exactly one row"""
+    @abstractmethod
+    def map_row(self, row: TRow) -> TRow:
+        """
+        :param row: one table row
+        :return: resulting row
+        """
+        pass
+
+    def __call__(self, row: TRow) -> TRowsGenerator:
+        yield self.map_row(row)
+
+
+class MapOne(Operation):
+    """Map operation for row mappers, which needs no generator per row"""
+    def __init__(self, mapper: RowMapper) -> None:
+        self.mapper = mapper
+
+    @staticmethod
+    def accepts(mapper: RowMapper) -> bool:
+        """
+        Check that mapper can be run by calling its map_row: it is not inherited by a subclass
+        which changes what the mapper does per row
+        :param mapper: mapper to check
+        """
+        return _defined_below(mapper, 'map_row', '__call__')
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        yield from map(self.mapper.map_row, rows)
+
+
+class BatchMapper(Mapper):
+    """
+    Base class for mappers which are also able to process a whole batch of rows at once.
+    Batch processing extracts columns of the batch and computes results column by column,
+    so the per-row interpreter overhead is paid inside C loops (map, zip, filter)
+    """
+    @abstractmethod
+    def map_batch(self, rows: tp.List[TRow]) -> TRowsIterable:
+        """
+        :param rows: batch of table rows
+        """
+        pass
+
+
+class BatchMap(Operation):
+    def __init__(self, mapper: BatchMapper, batch_size: int = 4096) -> None:
+        """
+        :param mapper: mapper to use
+        :param batch_size: number of rows passed to mapper at once
+        """
+        self.mapper = mapper
+        self.batch_size = batch_size
+
+    @staticmethod
+    def accepts(mapper: BatchMapper) -> bool:
+        """
+        Check that mapper can be run over batches: its map_batch is not inherited by a subclass
+        which changes what the mapper does per row
+        :param mapper: mapper to check
+        """
+        return _defined_below(
+            mapper, 'map_batch', '__call__', *(('map_row',) if isinstance(mapper, RowMapper) else ()))
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            yield from self.mapper.map_batch(batch)
 
 
 class Reducer(ABC):
@@ -71,20 +187,122 @@ class Reducer(ABC):
         """
         pass
 
+    def hash_aggregate(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> tp.Optional[TRowsIterable]:
+        """
+        Optional hook used by HashReduce: reduce rows of all groups coming in any order in one pass,
+        keeping only aggregated values per group instead of the rows.
+        It is not used for subclasses overriding __call__ but not hash_aggregate
+        :param group_key: key columns of groups
+        :param rows: rows of all groups
+        :return: reduced rows of all groups or None if the reducer does not support it (rows are not read then)
+        """
+        return None
+
 
 class Reduce(Operation):
     def __init__(self, reducer: Reducer, keys: tp.Sequence[str]) -> None:
         self.reducer = reducer
-        self.keys = keys
+        self.keys = _intern_columns(keys)
+        self._group_key = self.keys
+        self._key = _key_getter(keys)
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        if not self.keys:
+            yield from self.reducer((), rows)
+            return
+
+        reducer, group_key = self.reducer, self._group_key
+        for _, group in groupby(rows, key=self._key):
+            yield from reducer(group_key, group)
+
+
+class HashReduce(Operation):
+    """
+    Reduce over rows which are not sorted by keys. Reducers supporting hash aggregation (see Reducer.hash_aggregate)
+    reduce all groups in one pass keeping only a few values per group. Other reducers, and inputs where most of
+    the sampled keys are distinct so the hash table would be about as large as the data, are reduced after sorting
+    """
+    def __init__(self, reducer: Reducer, keys: tp.Sequence[str], sort: tp.Optional[Operation] = None,
+                 sample_size: int = 4096) -> None:
+        """
+        :param reducer: reducer to use
+        :param keys: keys for grouping
+        :param sort: operation sorting rows by keys when hash aggregation is not used, rows are sorted in memory
+            if it is not given
+        :param sample_size: number of first rows looked at to estimate the number of distinct keys
+        """
+        self.reducer = reducer
+        self.keys = _intern_columns(keys)
+        self.sort = sort
+        self.sample_size = sample_size
+        self._key = _key_getter(keys)
 
     def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
         if not self.keys:
             yield from self.reducer((), rows)
             return
 
-        for key, group in groupby(rows,
-                                  key=lambda row: tuple(row[col] for col in self.keys)):
-            yield from self.reducer(tuple(self.keys), group)
+        rows = iter(rows)
+        sample = list(islice(rows, self.sample_size))
+        rows = chain(sample, rows)
+        if _defined_below(self.reducer, 'hash_aggregate', '__call__') and \
+                len(set(map(self._key, sample))) * 2 <= len(sample):
+            aggregated = self.reducer.hash_aggregate(self.keys, rows)
+            if aggregated is not None:
+                yield from aggregated
+                return
+
+        sorted_rows = self.sort(rows) if self.sort is not None else sorted(rows, key=self._key)
+        yield from Reduce(self.reducer, self.keys)(sorted_rows)
+
+
+def _remove_spill_file(path: str, owner_pid: int) -> None:
+    # forked processes get a copy of SpilledRows, only the process which created the file removes it
+    if os.getpid() == owner_pid:
+        os.remove(path)
+
+
+class SpilledRows:
+    """
+    Re-iterable storage of rows for joiners and cached graphs. Only first memory_rows rows are kept in memory,
+    the rest are pickled in chunks to a temporary file. Every iteration opens the file anew, so several
+    iterations (also in forked processes) can go at the same time
+    """
+    CHUNK_SIZE = 1024
+
+    def __init__(self, rows: TRowsIterable, memory_rows: int = 8192) -> None:
+        """
+        :param rows: rows to store
+        :param memory_rows: number of rows kept in memory
+        """
+        rows = iter(rows)
+        self._head = list(islice(rows, memory_rows))
+        self._path: tp.Optional[str] = None
+
+        chunk = list(islice(rows, self.CHUNK_SIZE))
+        if chunk:
+            with tempfile.NamedTemporaryFile(delete=False) as file:
+                self._path = file.name
+                weakref.finalize(self, _remove_spill_file, file.name, os.getpid())
+                while chunk:
+                    pickle.dump(chunk, file, pickle.HIGHEST_PROTOCOL)
+                    chunk = list(islice(rows, self.CHUNK_SIZE))
+
+    def __bool__(self) -> bool:
+        return bool(self._head) or self._path is not None
+
+    def __iter__(self) -> tp.Iterator[TRow]:
+        yield from self._head
+        if self._path is None:
+            return
+
+        with open(self._path, 'rb') as file:
+            while True:
+                try:
+                    chunk = pickle.load(file)
+                except EOFError:
+                    return
+                yield from chunk
 
 
 class Joiner(ABC):
@@ -92,6 +310,7 @@ class Joiner(ABC):
     def __init__(self, suffix_a: str = '_1', suffix_b: str = '_2') -> None:
         self._a_suffix = suffix_a
         self._b_suffix = suffix_b
+        self._columns_cache: tp.Dict[tp.Tuple[tp.Any, ...], tp.Tuple[tp.Any, ...]] = {}
 
     @abstractmethod
     def __call__(self, keys: tp.Sequence[str], rows_a: TRowsIterable, rows_b: TRowsIterable) -> TRowsGenerator:
@@ -102,36 +321,36 @@ class Joiner(ABC):
         """
         pass
 
-    @staticmethod
-    def separate_columns(row_a: TRow, row_b: TRow, keys: tp.Sequence[str]) -> tp.Tuple[tp.Any, ...]:
-        set_a = set(row_a.keys())
-        set_b = set(row_b.keys())
-        set_keys = set(keys)
+    def separate_columns(self, row_a: TRow, row_b: TRow, keys: tp.Sequence[str]) -> tp.Tuple[tp.Any, ...]:
+        schema = (tuple(row_a), tuple(row_b), tuple(keys))
+        columns = self._columns_cache.get(schema)
+        if columns is None:
+            common_col = tuple(col for col in row_a if col in row_b and col not in keys)
+            col_from_left = tuple(col for col in row_a if col not in common_col)
+            col_from_right = tuple(col for col in row_b if col not in row_a)
+            columns = self._columns_cache[schema] = (col_from_left, col_from_right, common_col)
+
+        return columns
+
+    def join_row_list(self, row_a: TRow, lst_b: TRowsIterable,
+                      col_from_left: tp.Sequence[str], col_from_right: tp.Sequence[str],
+                      common_col: tp.Sequence[str]) -> TRowsGenerator:
+        a_part = {col: row_a[col] for col in col_from_left}
+        for col in common_col:
+            a_part[col + self._a_suffix] = row_a[col]
+        common_b = tuple((col, col + self._b_suffix) for col in common_col)
 
-        col_from_right = set_b - set_a & set_b
-        common_col = set_a & set_b - set_keys
-        col_from_left = set_a - common_col
-
-        return col_from_left, col_from_right, common_col
-
-    def join_row_list(self, row_a: TRow, lst_b: tp.List[TRow],
-                      col_from_left: tp.Set[str], col_from_right: tp.Set[str],
-                      common_col: tp.Set[str]) -> TRowsGenerator:
         for row_b in lst_b:
-            new_row = {}
-            for col in col_from_left:
-                new_row[col] = row_a[col]
-            for col in col_from_right:
-                new_row[col] = row_b[col]
-            for col in common_col:
-                new_row[col + self._a_suffix] = row_a[col]
-                new_row[col + self._b_suffix] = row_b[col]
+            new_row = a_part.copy()
+            new_row.update({col: row_b[col] for col in col_from_right})
+            for col, suffixed_col in common_b:
+                new_row[suffixed_col] = row_b[col]
 
             yield new_row
 
     def join_both(self, keys: tp.Sequence[str], row: TRow, rows_a: TRowsIterable,
-                  list_b: tp.List[TRow]) -> TRowsGenerator:
-        columns = self.separate_columns(row, list_b[0], keys)
+                  list_b: TRowsIterable) -> TRowsGenerator:
+        columns = self.separate_columns(row, next(iter(list_b)), keys)
         yield from self.join_row_list(row, list_b, *columns)
 
         for row in rows_a:
@@ -140,14 +359,15 @@ class Joiner(ABC):
 
 class Join(Operation):
     def __init__(self, joiner: Joiner, keys: tp.Sequence[str]):
-        self.keys = keys
+        self.keys = _intern_columns(keys)
         self.joiner = joiner
+        self._key = _key_getter(keys)
 
     def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
         rows_a = rows
         rows_b = args[0]
-        groupby_a = groupby(rows_a, key=lambda row: tuple(row[col] for col in self.keys))
-        groupby_b = groupby(rows_b, key=lambda row: tuple(row[col] for col in self.keys))
+        groupby_a = groupby(rows_a, key=self._key)
+        groupby_b = groupby(rows_b, key=self._key)
 
         group_one = next(groupby_a, None)
         group_two = next(groupby_b, None)
@@ -193,7 +413,7 @@ class FirstReducer(Reducer):
 # Mappers
 
 
-class Divide(Mapper):
+class Divide(RowMapper, BatchMapper):
     """
     Divide one column by another
     """
@@ -205,13 +425,22 @@ class Divide(Mapper):
         self.denominator = denominator
         self.result = result
 
-    def __call__(self, row: TRow) -> TRowsGenerator:
+    def map_row(self, row: TRow) -> TRow:
         assert row[self.denominator] != 0
         row[self.result] = row[self.nominator] / row[self.denominator]
-        yield row
+        return row
 
+    def map_batch(self, rows: tp.List[TRow]) -> TRowsIterable:
+        result = self.result
+        denominators = list(map(itemgetter(self.denominator), rows))
+        assert 0 not in denominators
+        values = map(truediv, map(itemgetter(self.nominator), rows), denominators)
+        for row, value in zip(rows, values):
+            row[result] = value
+        return rows
 
-class Log(Mapper):
+
+class Log(RowMapper, BatchMapper):
     """
     Get logarithm of a column
     """
@@ -223,39 +452,45 @@ class Log(Mapper):
         self.arg = arg
         self.result = result
 
-    def __call__(self, row: TRow) -> TRowsGenerator:
+    def map_row(self, row: TRow) -> TRow:
         row[self.result] = log(row[self.arg])
-        yield row
+        return row
 
+    def map_batch(self, rows: tp.List[TRow]) -> TRowsIterable:
+        result = self.result
+        for row, value in zip(rows, map(log, map(itemgetter(self.arg), rows))):
+            row[result] = value
+        return rows
 
-class FilterPunctuation(Mapper):
+
+class FilterPunctuation(RowMapper):
     """Left only non-punctuation symbols"""
     def __init__(self, column: str):
         """
         :param column: name of column to process
         """
-        self.column = column
+        self.column = sys.intern(column)
+        self._sub = _PUNCT_RE.sub
 
-    def __call__(self, row: TRow) -> TRowsGenerator:
-        row[self.column] = re.sub(r"[^\s\w]|_", "", row[self.column])
-        yield row
+    def map_row(self, row: TRow) -> TRow:
+        column = self.column
+        s = row[column]
+        row[column] = s.translate(_ASCII_PUNCT_TBL) if s.isascii() else self._sub('', s)
+        return row
 
 
-class LowerCase(Mapper):
+class LowerCase(RowMapper):
     """Replace column value with value in lower case"""
     def __init__(self, column: str):
         """
         :param column: name of column to process
         """
-        self.column = column
-
-    @staticmethod
-    def _lower_case(txt: str) -> str:
-        return txt.lower()
+        self.column = sys.intern(column)
 
-    def __call__(self, row: TRow) -> TRowsGenerator:
-        row[self.column] = self._lower_case(row[self.column])
-        yield row
+    def map_row(self, row: TRow) -> TRow:
+        column = self.column
+        row[column] = row[column].lower()
+        return row
 
 
 class Split(Mapper):
@@ -265,26 +500,61 @@ class Split(Mapper):
         :param column: name of column to split
         :param separator: string to separate by
         """
-        self.column = column
+        self.column = sys.intern(column)
         self.separator = separator
         if self.separator is None:
             self.separator = "\\s+"
+        self._fast = self.separator == "\\s+"
+        self._re = re.compile(self.separator)
 
     def __call__(self, row: TRow) -> TRowsGenerator:
-        if self.separator == "\\s+":
-            s = row[self.column] + ' '
-        else:
-            s = row[self.column] + self.separator
+        column = self.column
+        if self._fast:
+            text = row[column]
+            if not text or text[0].isspace():
+                # splitting by regex yields empty word before leading whitespace (or for empty text)
+                yield {**row, column: ''}
+            for token in text.split():
+                yield {**row, column: token}
+            return
 
+        s = row[column] + self.separator
         start = 0
-        for match in re.finditer(str(self.separator), s):
-            new_row = copy.copy(row)
-            new_row[self.column] = s[start:match.start()]
-            yield new_row
+        for match in self._re.finditer(s):
+            yield {**row, column: s[start:match.start()]}
             start = match.end()
 
 
-class Product(Mapper):
+class Tokenize(Mapper):
+    """
+    Split text into lower case words without punctuation.
+    Works as FilterPunctuation, LowerCase and Split applied one after another, but in a single pass
+    """
+    def __init__(self, column: str, min_length: int = 0) -> None:
+        """
+        :param column: name of column to tokenize
+        :param min_length: words shorter than min_length are dropped
+        """
+        self.column = sys.intern(column)
+        self.min_length = min_length
+        self._sub = _PUNCT_RE.sub
+
+    def __call__(self, row: TRow) -> TRowsGenerator:
+        column = self.column
+        min_length = self.min_length
+        intern = sys.intern
+        text = row[column]
+        text = text.translate(_ASCII_PUNCT_TBL) if text.isascii() else self._sub('', text)
+        if (not text or text[0].isspace()) and min_length <= 0:
+            # same empty word as Split yields
+            yield {**row, column: ''}
+        for token in text.lower().split():
+            if len(token) >= min_length:
+                # repeated words share one string object, so their hashing and comparison in reduces is cheaper
+                yield {**row, column: intern(token)}
+
+
+class Product(RowMapper, BatchMapper):
     """Calculates product of multiple columns"""
     def __init__(self, columns: tp.Sequence[str], result_column: str = 'product') -> None:
         """
@@ -292,17 +562,33 @@ class Product(Mapper):
         :param result_column: column name to save product in
         """
         self.columns = columns
-        self.result_column = result_column
+        self.result_column = sys.intern(result_column)
+        self._cols = _intern_columns(columns)
+
+    def map_row(self, row: TRow) -> TRow:
+        values: tp.Iterable[tp.Any]
+        if len(self._cols) == 2:
+            a, b = self._cols
+            row[self.result_column] = row[a] * row[b]
+        else:
+            row[self.result_column] = prod(row[col] for col in self._cols)
+        return row
+
+    def map_batch(self, rows: tp.List[TRow]) -> TRowsIterable:
+        values: tp.Iterable[tp.Any]
+        if len(self._cols) == 2:
+            a, b = self._cols
+            values = map(mul, map(itemgetter(a), rows), map(itemgetter(b), rows))
+        else:
+            values = (prod(row[col] for col in self._cols) for row in rows)
 
-    def __call__(self, row: TRow) -> TRowsGenerator:
-        prod = 1
-        for col in self.columns:
-            prod *= row[col]
-        row[self.result_column] = prod
-        yield row
+        result_column = self.result_column
+        for row, value in zip(rows, values):
+            row[result_column] = value
+        return rows
 
 
-class Filter(Mapper):
+class Filter(BatchMapper):
     """Remove records that don't satisfy some condition"""
     def __init__(self, condition: tp.Callable[[TRow], bool]) -> None:
         """
@@ -314,20 +600,115 @@ class Filter(Mapper):
         if self.condition(row):
             yield row
 
+    def map_batch(self, rows: tp.List[TRow]) -> TRowsIterable:
+        return filter(self.condition, rows)
+
 
-class Project(Mapper):
+class Project(RowMapper, BatchMapper):
     """Leave only mentioned columns"""
-    def __init__(self, columns: tp.Sequence[str]) -> None:
+    def __init__(self, columns: tp.Sequence[str], inplace: bool = False) -> None:
         """
         :param columns: names of columns
+        :param inplace: remove other columns from the passed row instead of building a new one,
+            use it when the row is not referenced anywhere else
         """
-        self.columns = columns
+        self.columns = _intern_columns(columns)
+        self.inplace = inplace
+        self._columns_set = frozenset(self.columns)
+        self._project = self._make_project(self.columns, self._columns_set, inplace)
+
+    @staticmethod
+    def _make_project(columns: tp.Tuple[str, ...], columns_set: tp.FrozenSet[str],
+                      inplace: bool) -> tp.Callable[[TRow], TRow]:
+        """
+        Build projecting function specialized for the instance: columns and mode are bound in the closure,
+        so no attribute lookups and mode checks are done per row
+        """
+        if inplace:
+            def project_inplace(row: TRow) -> TRow:
+                if row.keys() != columns_set:
+                    for col in [col for col in row if col not in columns_set]:
+                        del row[col]
+                return row
+
+            return project_inplace
+
+        def project(row: TRow) -> TRow:
+            if row.keys() == columns_set:
+                return row
+            return {col: row[col] for col in columns}
+
+        return project
+
+    def map_row(self, row: TRow) -> TRow:
+        return self._project(row)
+
+    def map_batch(self, rows: tp.List[TRow]) -> TRowsIterable:
+        return list(map(self._project, rows))
+
+
+class BroadcastConstant(RowMapper, BatchMapper):
+    """Add column with the same value to every row"""
+    def __init__(self, column: str, value: tp.Any) -> None:
+        """
+        :param column: result column name
+        :param value: value to put in every row
+        """
+        self.column = column
+        self.value = value
+
+    def map_row(self, row: TRow) -> TRow:
+        row[self.column] = self.value
+        return row
+
+    def map_batch(self, rows: tp.List[TRow]) -> TRowsIterable:
+        column, value = self.column, self.value
+        for row in rows:
+            row[column] = value
+        return rows
+
+
+_DEFAULT_TIME_FORMAT = "%Y%m%dT%H%M%S.%f"
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
 
-    def __call__(self, row: TRow) -> TRowsGenerator:
-        yield {col: row[col] for col in self.columns}
+
+def _parse_time(time: str) -> datetime:
+    """
+    Parse time in "%Y%m%dT%H%M%S.%f" or "%Y%m%dT%H%M%S" format by slicing the fixed width fields,
+    which is much faster than datetime.strptime
+    """
+    microsecond = int(time[16:].ljust(6, '0')) if len(time) > 15 else 0
+    return datetime(int(time[0:4]), int(time[4:6]), int(time[6:8]),
+                    int(time[9:11]), int(time[11:13]), int(time[13:15]), microsecond)
+
+
+def _time_parser(time_format: str) -> tp.Callable[[str], datetime]:
+    """
+    Get function parsing time in given format, times without fractional seconds are accepted as well
+    :param time_format: time format
+    """
+    if time_format == _DEFAULT_TIME_FORMAT:
+        return _parse_time
+
+    if time_format.endswith('.%f'):
+        # choose format by presence of fractional seconds instead of catching ValueError
+        short_format = time_format[:-len('.%f')]
+
+        def parse_fraction(time: str) -> datetime:
+            return datetime.strptime(time, time_format if '.' in time else short_format)
+
+        return parse_fraction
+
+    def parse(time: str) -> datetime:
+        try:
+            return datetime.strptime(time, time_format)
+        except ValueError:
+            return datetime.strptime(time, "%Y%m%dT%H%M%S")
+
+    return parse
 
 
-class WeekHour(Mapper):
+class WeekHour(RowMapper):
     """
     Extract weekday and hour from time using given time format to parse
     """
@@ -342,20 +723,44 @@ class WeekHour(Mapper):
         self.format = format
         self.weekday_result = weekday_result
         self.hour_result = hour_result
-        self.weekdays = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+        self.weekdays = _WEEKDAYS
+        self._parse = _time_parser(format)
+        self._default_format = format == _DEFAULT_TIME_FORMAT
 
-    def __call__(self, row: TRow) -> TRowsGenerator:
-        try:
-            dt = datetime.strptime(row[self.time], self.format)
-        except ValueError:
-            dt = datetime.strptime(row[self.time], "%Y%m%dT%H%M%S")
+    def map_row(self, row: TRow) -> TRow:
+        if self._default_format:
+            # only date and hour fields are needed, so the full datetime is not built
+            time = row[self.time]
+            row[self.weekday_result] = _WEEKDAYS[date(int(time[0:4]), int(time[4:6]), int(time[6:8])).weekday()]
+            row[self.hour_result] = int(time[9:11])
+            return row
+
+        dt = self._parse(row[self.time])
 
         row[self.weekday_result] = self.weekdays[dt.weekday()]
         row[self.hour_result] = dt.hour
-        yield row
+        return row
+
+
+_EARTH_RADIUS_KM = 6371.0
+_EARTH_DIAMETER_KM = 2 * _EARTH_RADIUS_KM
+_DEG_TO_RAD = pi / 180
+_HALF_DEG_TO_RAD = _DEG_TO_RAD / 2
 
 
-class Length(Mapper):
+def _haversine(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    """
+    Calculate the great circle distance in kilometers between two points
+    on the earth (specified in decimal degrees)
+    """
+    lat1 *= _DEG_TO_RAD
+    lat2 *= _DEG_TO_RAD
+    sin_dlat = sin((lat2 - lat1) * 0.5)
+    sin_dlon = sin((lon2 - lon1) * _HALF_DEG_TO_RAD)
+    return _EARTH_DIAMETER_KM * asin(sqrt(sin_dlat * sin_dlat + cos(lat1) * cos(lat2) * sin_dlon * sin_dlon))
+
+
+class Length(RowMapper, BatchMapper):
     """
     Use haversine formula to calculate length between to points on earth
     """
@@ -369,13 +774,11 @@ class Length(Mapper):
         self.end = end
         self.result = result
 
-    def __call__(self, row: TRow) -> TRowsGenerator:
-        if self.result in row:
-            yield row
-            return
-
-        row[self.result] = self.haversine(row)
-        yield row
+    def map_row(self, row: TRow) -> TRow:
+        if self.result not in row:
+            (lon1, lat1), (lon2, lat2) = row[self.start], row[self.end]
+            row[self.result] = _haversine(lon1, lat1, lon2, lat2)
+        return row
 
     def haversine(self, row: TRow) -> float:
         """
@@ -384,22 +787,57 @@ class Length(Mapper):
         """
         lon1, lat1 = row[self.start]
         lon2, lat2 = row[self.end]
+        return _haversine(lon1, lat1, lon2, lat2)
 
-        # convert decimal degrees to radians
-        lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-
-        # haversine formula
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-        c = 2 * asin(sqrt(a))
-        r = 6371.0  # Radius of earth in kilometers
-        return c * r
+    def map_batch(self, rows: tp.List[TRow]) -> TRowsIterable:
+        start, end, result = self.start, self.end, self.result
+        for row in rows:
+            if result not in row:
+                (lon1, lat1), (lon2, lat2) = row[start], row[end]
+                row[result] = _haversine(lon1, lat1, lon2, lat2)
+        return rows
 
 
 # Reducers
 
 
+def _key_row(group_key: tp.Tuple[str, ...], key: tp.Any) -> TRow:
+    """
+    Build row with key columns of a hash aggregated group
+    :param group_key: key columns of groups
+    :param key: key value of the group as returned by _key_getter
+    """
+    return {group_key[0]: key} if len(group_key) == 1 else dict(zip(group_key, key))
+
+
+def _aggregated_rows(group_key: tp.Tuple[str, ...], column: str,
+                     values: tp.Iterable[tp.Tuple[tp.Any, tp.Any]]) -> TRowsGenerator:
+    """
+    Build rows of hash aggregated groups
+    :param group_key: key columns of groups
+    :param column: column for aggregated value
+    :param values: pairs of group key value and aggregated value
+    """
+    for key, value in values:
+        new_row = _key_row(group_key, key)
+        new_row[column] = value
+        yield new_row
+
+
+def _group_row(group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> tp.Tuple[TRow, tp.Iterator[TRow]]:
+    """
+    Peek the first row of the group to get group key values without checking every row
+    :param group_key: key columns of the group
+    :param rows: rows of the group
+    :return: row with key columns and iterator over all rows of the group
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return {}, rows
+    return {col: first[col] for col in group_key}, chain((first,), rows)
+
+
 class Speed(Reducer):
     """
     Calculate avarage speed for specific weekday and hour
@@ -417,27 +855,16 @@ class Speed(Reducer):
         self.leave_col = leave_col
         self.time_format = time_format
         self.result = result
+        self._parse = _time_parser(time_format)
 
     def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
+        parse = self._parse
         length_total: float = 0
         time_total: float = 0
 
-        new_row: TRow = {}
+        new_row, rows = _group_row(group_key, rows)
         for row in rows:
-            if not new_row:
-                new_row = {col: row[col] for col in group_key}
-
-            try:
-                dt_1 = datetime.strptime(row[self.enter_col], self.time_format)
-            except ValueError:
-                dt_1 = datetime.strptime(row[self.enter_col], "%Y%m%dT%H%M%S")
-
-            try:
-                dt_2 = datetime.strptime(row[self.leave_col], self.time_format)
-            except ValueError:
-                dt_2 = datetime.strptime(row[self.leave_col], "%Y%m%dT%H%M%S")
-
-            td = dt_2 - dt_1
+            td = parse(row[self.leave_col]) - parse(row[self.enter_col])
 
             time_total += (td.seconds + td.microseconds * 10**(-6)) / 3600
             length_total += row[self.length_col]
@@ -457,15 +884,12 @@ class CountUnique(Reducer):
         self.result_column = result_column
 
     def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
-        values_set = set()
-        new_row: TRow = {}
+        new_row, rows = _group_row(group_key, rows)
+        values_set: tp.Set[tp.Any] = set()
+        add = values_set.add
+        column = self.column
         for row in rows:
-            if not new_row and group_key:
-                new_row = {col: row[col] for col in group_key}
-
-            if row[self.column] in values_set:
-                continue
-            values_set.add(row[self.column])
+            add(row[column])
 
         new_row[self.result_column] = len(values_set)
 
@@ -473,7 +897,10 @@ class CountUnique(Reducer):
 
 
 class TopN(Reducer):
-    """Calculate top N by value"""
+    """
+    Calculate top N by value. Rows are yielded in descending order of value,
+    of rows with equal values the ones coming earlier in the group are taken first
+    """
     def __init__(self, column: str, n: int) -> None:
         """
         :param column: column name to get top by
@@ -483,20 +910,7 @@ class TopN(Reducer):
         self.n = n
 
     def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
-        heap: tp.List[tp.Tuple[str, int]] = []
-        topn: tp.List[TRow] = []
-        for row in rows:
-            if len(heap) < self.n:
-                heapq.heappush(heap, (row[self.column_max], len(heap)))
-                topn.append(row)
-                continue
-            if row[self.column_max] > heap[0][0]:
-                replace_idx = heap[0][1]
-                heapq.heapreplace(heap, (row[self.column_max], replace_idx))
-                topn[replace_idx] = row
-
-        topn.sort(key=lambda row: row[self.column_max], reverse=True)
-        return (row for row in topn)
+        yield from heapq.nlargest(self.n, rows, key=itemgetter(self.column_max))
 
 
 class TermFrequency(Reducer):
@@ -510,28 +924,53 @@ class TermFrequency(Reducer):
         self.result_column = result_column
 
     def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
-        n_words = 0
-        counter: tp.Dict[tp.Any, int] = {}
-        new_row: TRow = {}
+        new_row, rows = _group_row(group_key, rows)
+        counter = Counter(map(itemgetter(self.words_column), rows))
+        if not counter:
+            return
 
-        for row in rows:
-            if not new_row:
-                new_row = {col: row[col] for col in group_key}
+        words_column, result_column = self.words_column, self.result_column
+        n_words = sum(counter.values())
+        for key, val in counter.items():
+            row = new_row.copy()
+            row[words_column] = key
+            row[result_column] = val / n_words
+            yield row
 
-            if row[self.words_column] not in counter:
-                counter[row[self.words_column]] = 1
-            else:
-                counter[row[self.words_column]] += 1
+    def hash_aggregate(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> tp.Optional[TRowsIterable]:
+        key, words_column = _key_getter(group_key), self.words_column
+        counts = Counter((key(row), row[words_column]) for row in rows)
+        totals: tp.DefaultDict[tp.Any, int] = defaultdict(int)
+        for (group, _), count in counts.items():
+            totals[group] += count
+        return self._hash_frequencies(group_key, counts, totals)
+
+    def _hash_frequencies(self, group_key: tp.Tuple[str, ...], counts: tp.Mapping[tp.Tuple[tp.Any, str], int],
+                          totals: tp.Mapping[tp.Any, int]) -> TRowsGenerator:
+        words_column, result_column = self.words_column, self.result_column
+        for (group, word), count in counts.items():
+            new_row = _key_row(group_key, group)
+            new_row[words_column] = word
+            new_row[result_column] = count / totals[group]
+            yield new_row
 
-            n_words += 1
 
-        for key, val in counter.items():
-            tf = val / n_words
-            row = copy.copy(new_row)
-            row[self.words_column] = key
-            row[self.result_column] = tf
+class FilterByGroupCount(Reducer):
+    """Leave rows only of groups having at least min_count rows"""
+    def __init__(self, min_count: int) -> None:
+        """
+        :param min_count: minimal number of rows in group
+        """
+        self.min_count = min_count
 
-            yield row
+    def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
+        rows = iter(rows)
+        head = list(islice(rows, self.min_count))
+        if len(head) < self.min_count:
+            return
+
+        yield from head
+        yield from rows
 
 
 class Count(Reducer):
@@ -551,16 +990,17 @@ class Count(Reducer):
 
     def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
         count = 0
-        new_row: TRow = {}
-        for row in rows:
-            if not new_row:
-                new_row = {col: row[col] for col in group_key}
-
+        new_row, rows = _group_row(group_key, rows)
+        for _ in rows:
             count += 1
 
         new_row[self.column] = count
         yield new_row
 
+    def hash_aggregate(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> tp.Optional[TRowsIterable]:
+        counts = Counter(map(_key_getter(group_key), rows))
+        return _aggregated_rows(group_key, self.column, counts.items())
+
 
 class Sum(Reducer):
     """
@@ -579,16 +1019,20 @@ class Sum(Reducer):
 
     def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
         s = 0
-        new_row: TRow = {}
+        new_row, rows = _group_row(group_key, rows)
         for row in rows:
-            if not new_row:
-                new_row = {col: row[col] for col in group_key}
-
             s += row[self.column]
 
         new_row[self.column] = s
         yield new_row
 
+    def hash_aggregate(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> tp.Optional[TRowsIterable]:
+        sums: tp.DefaultDict[tp.Any, tp.Any] = defaultdict(int)
+        key, column = _key_getter(group_key), self.column
+        for row in rows:
+            sums[key(row)] += row[column]
+        return _aggregated_rows(group_key, column, sums.items())
+
 
 # Joiners
 
@@ -596,22 +1040,34 @@ class Sum(Reducer):
 class InnerJoiner(Joiner):
     """Join with inner strategy"""
     def __call__(self, keys: tp.Sequence[str], rows_a: TRowsIterable, rows_b: TRowsIterable) -> TRowsGenerator:
-        list_b = list(rows_b)
-        if not list_b:
+        rows_a = iter(rows_a)
+        row = next(rows_a, None)
+        if row is None:
             return
 
-        row = next(iter(rows_a), None)
-        if row is None:
+        second_row = next(rows_a, None)
+        if second_row is None:
+            # single left row (e.g. a per-key aggregate) is joined with right rows as they come, nothing is buffered
+            rows_b = iter(rows_b)
+            row_b = next(rows_b, None)
+            if row_b is None:
+                return
+            columns = self.separate_columns(row, row_b, keys)
+            yield from self.join_row_list(row, chain((row_b,), rows_b), *columns)
             return
 
-        yield from self.join_both(keys, row, rows_a, list_b)
+        list_b = SpilledRows(rows_b)
+        if not list_b:
+            return
+
+        yield from self.join_both(keys, row, chain((second_row,), rows_a), list_b)
 
 
 class OuterJoiner(Joiner):
     """Join with outer strategy"""
     def __call__(self, keys: tp.Sequence[str], rows_a: TRowsIterable,
                  rows_b: TRowsIterable) -> TRowsGenerator:
-        list_b = list(rows_b)
+        list_b = SpilledRows(rows_b)
         if not list_b:
             yield from rows_a
             return
@@ -629,7 +1085,7 @@ class LeftJoiner(Joiner):
 
     def __call__(self, keys: tp.Sequence[str], rows_a: TRowsIterable,
                  rows_b: TRowsIterable) -> TRowsGenerator:
-        list_b = list(rows_b)
+        list_b = SpilledRows(rows_b)
         if not list_b:
             yield from rows_a
             return
@@ -646,7 +1102,7 @@ class RightJoiner(Joiner):
 
     def __call__(self, keys: tp.Sequence[str], rows_a: TRowsIterable,
                  rows_b: TRowsIterable) -> TRowsGenerator:
-        list_a = list(rows_a)
+        list_a = SpilledRows(rows_a)
         if not list_a:
             yield from rows_b
 
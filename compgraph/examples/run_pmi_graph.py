@@ -1,6 +1,10 @@
-import json
 from argparse import ArgumentParser
 
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads  # type: ignore[assignment]
+
 import compgraph.operations as operations
 from compgraph.graph import Graph
 
@@ -8,19 +12,14 @@ from compgraph.graph import Graph
 def pmi_graph_from_file(input_file_name: str, doc_column: str = 'doc_id', text_column: str = 'text',
                         result_column: str = 'pmi') -> Graph:
     """Constructs graph which gives for every document the top 10 words ranked by pointwise mutual information"""
-    words = Graph.graph_from_file(input_file_name, json.loads) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column)) \
-        .map(operations.Filter(lambda row: len(row[text_column]) > 4)) \
+    words = Graph.graph_from_file(input_file_name, loads) \
+        .map(operations.Project([doc_column, text_column], inplace=True)) \
+        .map(operations.Tokenize(text_column, min_length=5)) \
         .sort([doc_column, text_column])
 
-    filtered = words.sort([doc_column, text_column]) \
-        .reduce(operations.Count('count'), [doc_column, text_column]) \
-        .map(operations.Filter(lambda row: row['count'] >= 2)) \
-        .map(operations.Project([doc_column, text_column])) \
-
-    filtered = filtered.join(operations.InnerJoiner(), words, [doc_column, text_column]) \
+    # both frequency branches read filtered words, so they are computed once
+    filtered = words.reduce(operations.FilterByGroupCount(2), [doc_column, text_column]) \
+        .cache()
 
     frequency = filtered.reduce(operations.TermFrequency(text_column, 'freq'), [doc_column])\
         .sort([text_column])
@@ -31,7 +30,7 @@ def pmi_graph_from_file(input_file_name: str, doc_column: str = 'doc_id', text_c
     graph = frequency.join(operations.InnerJoiner(), frequency_all, [text_column])\
         .map(operations.Divide(nominator='freq', denominator='freq_all', result='fraq'))\
         .map(operations.Log(arg='fraq', result=result_column)) \
-        .map(operations.Project([doc_column, text_column, result_column])) \
+        .map(operations.Project([doc_column, text_column, result_column], inplace=True)) \
         .sort([doc_column, result_column, text_column]) \
         .reduce(operations.TopN(result_column, 10), [doc_column])
 
@@ -43,14 +42,15 @@ def main() -> None:
 
     arg_parser.add_argument('-i', '--input', required=True, help='Input file path')
     arg_parser.add_argument('-o', '--output', required=True, help='Output file path')
+    arg_parser.add_argument('-p', '--parallel', action='store_true',
+                            help='Compute independent branches of the graph in separate processes')
     args = arg_parser.parse_args()
 
     graph = pmi_graph_from_file(args.input)
-    result = graph.run()
+    result = graph.run_parallel() if args.parallel else graph.run()
 
-    with open(args.output, "w") as out:
-        for row in result:
-            print(row, file=out)
+    with open(args.output, "w", buffering=1 << 20) as out:
+        out.writelines(f'{row}\n' for row in result)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
-import json
 from argparse import ArgumentParser
 
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads  # type: ignore[assignment]
+
 import compgraph.operations as operations
 from compgraph.graph import Graph
 
@@ -16,18 +20,14 @@ def main() -> None:
     text_column = 'text'
     count_column = 'count'
 
-    graph = Graph.graph_from_file(input_stream_name, json.loads) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column)) \
-        .sort([text_column]) \
-        .reduce(operations.Count(count_column), [text_column]) \
+    graph = Graph.graph_from_file(input_stream_name, loads) \
+        .map(operations.Tokenize(text_column)) \
+        .hash_reduce(operations.Count(count_column), [text_column]) \
         .sort([count_column, text_column])
 
     result = graph.run()
-    with open(args.output, "w") as out:
-        for row in result:
-            print(row, file=out)
+    with open(args.output, "w", buffering=1 << 20) as out:
+        out.writelines(f'{row}\n' for row in result)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
-import json
 from argparse import ArgumentParser
 
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads  # type: ignore[assignment]
+
 import compgraph.operations as operations
 from compgraph.graph import Graph
 
@@ -13,12 +17,12 @@ def yandex_maps_graph(input_file_name_time: str, input_file_name_length: str,
     """Constructs graph which measures average speed in km/h depending on the weekday and hour"""
     time_format = "%Y%m%dT%H%M%S.%f"
 
-    time = Graph.graph_from_file(input_file_name_time, json.loads) \
+    time = Graph.graph_from_file(input_file_name_time, loads) \
         .map(operations.WeekHour(enter_time_column, time_format,
                                  weekday_result_column, hour_result_column)) \
         .sort([edge_id_column])
 
-    length = Graph.graph_from_file(input_file_name_length, json.loads) \
+    length = Graph.graph_from_file(input_file_name_length, loads) \
         .map(operations.Length(start_coord_column, end_coord_column, "length")) \
         .sort([edge_id_column])
 
@@ -41,9 +45,8 @@ def main() -> None:
     graph = yandex_maps_graph(args.input_time, args.input_length)
 
     result = graph.run()
-    with open(args.output, "w") as out:
-        for row in result:
-            print(row, file=out)
+    with open(args.output, "w", buffering=1 << 20) as out:
+        out.writelines(f'{row}\n' for row in result)
 
 
 if __name__ == "__main__":
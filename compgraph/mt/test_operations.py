@@ -101,6 +101,68 @@ MAP_CASES = [
         cmp_keys=("test_id", "text"),
         mapper_etalon_items=(0, 1, 2)
     ),
+    MapCase(
+        mapper=ops.Split(column='text'),
+        data=[
+            {'test_id': 1, 'text': ''},
+            {'test_id': 2, 'text': '  leading and trailing  '},
+            {'test_id': 3, 'text': 'inner  spaces'}
+        ],
+        etalon=[
+            {'test_id': 1, 'text': ''},
+
+            {'test_id': 2, 'text': ''},
+            {'test_id': 2, 'text': 'and'},
+            {'test_id': 2, 'text': 'leading'},
+            {'test_id': 2, 'text': 'trailing'},
+
+            {'test_id': 3, 'text': 'inner'},
+            {'test_id': 3, 'text': 'spaces'}
+        ],
+        cmp_keys=("test_id", "text"),
+        mapper_item=1,
+        mapper_etalon_items=(1, 2, 3, 4)
+    ),
+    MapCase(
+        mapper=ops.Tokenize(column='text'),
+        data=[
+            {'test_id': 1, 'text': 'Hello, World!'},
+            {'test_id': 2, 'text': 'snake_case\tand  MORE...'},
+            {'test_id': 3, 'text': '?!'},
+            {'test_id': 4, 'text': ' Leading space'}
+        ],
+        etalon=[
+            {'test_id': 1, 'text': 'hello'},
+            {'test_id': 1, 'text': 'world'},
+
+            {'test_id': 2, 'text': 'and'},
+            {'test_id': 2, 'text': 'more'},
+            {'test_id': 2, 'text': 'snakecase'},
+
+            {'test_id': 3, 'text': ''},
+
+            {'test_id': 4, 'text': ''},
+            {'test_id': 4, 'text': 'leading'},
+            {'test_id': 4, 'text': 'space'}
+        ],
+        cmp_keys=("test_id", "text"),
+        mapper_etalon_items=(0, 1)
+    ),
+    MapCase(
+        mapper=ops.Tokenize(column='text', min_length=4),
+        data=[
+            {'test_id': 1, 'text': 'Hello, my World!'},
+            {'test_id': 2, 'text': 'a bc def GHIJ'}
+        ],
+        etalon=[
+            {'test_id': 1, 'text': 'hello'},
+            {'test_id': 1, 'text': 'world'},
+
+            {'test_id': 2, 'text': 'ghij'}
+        ],
+        cmp_keys=("test_id", "text"),
+        mapper_etalon_items=(0, 1)
+    ),
     MapCase(
         mapper=ops.Product(columns=['speed', 'distance'], result_column='time'),
         data=[
@@ -147,6 +209,18 @@ MAP_CASES = [
             {'value': 144}
         ],
         cmp_keys=("value",)
+    ),
+    MapCase(
+        mapper=ops.Project(columns=['test_id', 'value'], inplace=True),
+        data=[
+            {'test_id': 1, 'junk': 'x', 'value': 42},
+            {'value': 1, 'test_id': 2},
+        ],
+        etalon=[
+            {'test_id': 1, 'value': 42},
+            {'test_id': 2, 'value': 1},
+        ],
+        cmp_keys=("test_id", "value")
     )
 ]
 
@@ -162,6 +236,16 @@ def test_mapper(case: MapCase) -> None:
     assert isinstance(mapper_result, tp.Iterator)
     assert sorted(mapper_etalon_rows, key=key_func) == sorted(mapper_result, key=key_func)
 
+    if isinstance(case.mapper, ops.RowMapper):
+        one_result = ops.MapOne(case.mapper)(iter(copy.deepcopy(case.data)))
+        assert isinstance(one_result, tp.Iterator)
+        assert sorted(case.etalon, key=key_func) == sorted(one_result, key=key_func)
+
+    if isinstance(case.mapper, ops.BatchMapper):
+        batch_result = ops.BatchMap(case.mapper, batch_size=2)(iter(copy.deepcopy(case.data)))
+        assert isinstance(batch_result, tp.Iterator)
+        assert sorted(case.etalon, key=key_func) == sorted(batch_result, key=key_func)
+
     result = ops.Map(case.mapper)(iter(case.data))
     assert isinstance(result, tp.Iterator)
     assert sorted(case.etalon, key=key_func) == sorted(result, key=key_func)
@@ -271,6 +355,29 @@ REDUCE_CASES = [
         reduce_data_items=(0, 1, 2),
         reduce_etalon_items=(0, 1, 2)
     ),
+    ReduceCase(
+        reducer=ops.FilterByGroupCount(min_count=2),
+        reducer_keys=("word",),
+        data=[
+            {'sentence_id': 2, 'word': 'hell'},
+            {'sentence_id': 1, 'word': 'hello'},
+            {'sentence_id': 2, 'word': 'hello'},
+            {'sentence_id': 1, 'word': 'little'},
+            {'sentence_id': 2, 'word': 'little'},
+            {'sentence_id': 3, 'word': 'little'},
+            {'sentence_id': 1, 'word': 'world'},
+        ],
+        etalon=[
+            {'sentence_id': 1, 'word': 'hello'},
+            {'sentence_id': 2, 'word': 'hello'},
+            {'sentence_id': 1, 'word': 'little'},
+            {'sentence_id': 2, 'word': 'little'},
+            {'sentence_id': 3, 'word': 'little'},
+        ],
+        cmp_keys=("sentence_id", "word"),
+        reduce_data_items=(3, 4, 5),
+        reduce_etalon_items=(2, 3, 4)
+    ),
     ReduceCase(
         reducer=ops.Count(column='count'),
         reducer_keys=("word",),
@@ -338,6 +445,31 @@ def test_reducer(case: ReduceCase) -> None:
     assert sorted(case.etalon, key=key_func) == sorted(result, key=key_func)
 
 
+def test_divide_by_zero() -> None:
+    mapper = ops.Divide(nominator='a', denominator='b', result='c')
+    with pytest.raises(AssertionError):
+        mapper.map_row({'a': 1, 'b': 0})
+    with pytest.raises(AssertionError):
+        mapper.map_batch([{'a': 1, 'b': 2}, {'a': 1, 'b': 0.0}])
+
+
+def test_top_n_ties() -> None:
+    data = [
+        {'key': 1, 'value': 1, 'i': 0},
+        {'key': 1, 'value': 2, 'i': 1},
+        {'key': 1, 'value': 1, 'i': 2},
+        {'key': 1, 'value': 2, 'i': 3},
+        {'key': 1, 'value': 1, 'i': 4}
+    ]
+    etalon = [
+        {'key': 1, 'value': 2, 'i': 1},
+        {'key': 1, 'value': 2, 'i': 3},
+        {'key': 1, 'value': 1, 'i': 0}
+    ]
+
+    assert etalon == list(ops.TopN(column='value', n=3)(('key',), iter(data)))
+
+
 @dataclasses.dataclass
 class JoinCase:
     joiner: ops.Joiner
@@ -521,6 +653,30 @@ def test_joiner(case: JoinCase) -> None:
     assert sorted(case.etalon, key=key_func) == sorted(result, key=key_func)
 
 
+@pytest.mark.parametrize("joiner", [ops.InnerJoiner(), ops.OuterJoiner(), ops.LeftJoiner(), ops.RightJoiner()])
+def test_joiner_spilled_group(joiner: ops.Joiner) -> None:
+    # buffered side of the group is larger than the part of it kept in memory
+    small = [{'key': 1, 'a': i} for i in range(3)]
+    large = [{'key': 1, 'b': i} for i in range(10000)]
+    data_left, data_right = (large, small) if isinstance(joiner, ops.RightJoiner) else (small, large)
+    etalon = [{'key': 1, 'a': i, 'b': j} for i in range(3) for j in range(10000)]
+
+    key_func = _Key('key', 'a', 'b')
+    result = ops.Join(joiner, ('key',))(iter(data_left), iter(data_right))
+    assert sorted(etalon, key=key_func) == sorted(result, key=key_func)
+
+
+def test_spilled_rows() -> None:
+    data = [{'n': i} for i in range(5000)]
+    rows = ops.SpilledRows(iter(data), memory_rows=10)
+    assert rows
+    assert data == list(rows)
+    assert list(zip(data, data)) == list(zip(rows, rows))  # iterations going at the same time
+
+    assert ops.SpilledRows(iter(data), memory_rows=0)
+    assert not ops.SpilledRows(iter([]))
+
+
 # ########## HEAVY TESTS WITH MEMORY TRACKING ##########
 
 
@@ -14,5 +14,6 @@ setup(
     packages=packages,
     package_dir=packages,
     include_package_data=False,
-    install_requires=['psutil']
+    install_requires=['psutil'],
+    extras_require={'fast': ['orjson']}
 )
@@ -1,10 +1,13 @@
+import copy
 import dataclasses
+import os
 import typing as tp
 
 import pytest
 from pytest import approx
 
 from compgraph import operations as ops
+from compgraph import graph as graph_module
 from compgraph.graph import Graph
 
 
@@ -67,6 +70,18 @@ MAP_CASES = [
         ],
         cmp_keys=('time', 'weekday', 'hour')
     ),
+    MapCase(
+        mapper=ops.WeekHour('time', '%Y-%m-%dT%H:%M:%S.%f', 'weekday', 'hour'),
+        data=[
+            {'time': '2017-10-22T13:18:28.330000'},
+            {'time': '2017-10-11T16:14:58'},
+        ],
+        etalon=[
+            {'time': '2017-10-22T13:18:28.330000', 'weekday': 'Sun', 'hour': 13},
+            {'time': '2017-10-11T16:14:58', 'weekday': 'Wed', 'hour': 16},
+        ],
+        cmp_keys=('time', 'weekday', 'hour')
+    ),
     MapCase(
         mapper=ops.Length('start', 'end', 'length'),
         data=[
@@ -94,6 +109,11 @@ MAP_CASES = [
 def test_mapper(case: MapCase) -> None:
     key_func = _Key(*case.cmp_keys)
 
+    if isinstance(case.mapper, ops.BatchMapper):
+        batch_result = ops.BatchMap(case.mapper, batch_size=2)(iter(copy.deepcopy(case.data)))
+        assert isinstance(batch_result, tp.Iterator)
+        assert sorted(case.etalon, key=key_func) == sorted(batch_result, key=key_func)
+
     result = ops.Map(case.mapper)(iter(case.data))
     assert isinstance(result, tp.Iterator)
     assert sorted(case.etalon, key=key_func) == sorted(result, key=key_func)
@@ -190,6 +210,42 @@ def test_graph_map():
     assert expected == list(graph.run(input=lambda: iter(data)))
 
 
+def test_graph_batch_map():
+    data = [{'a': i, 'b': i + 1} for i in range(10000)]
+    expected = [{'a': i, 'b': i + 1, 'product': i * (i + 1)} for i in range(10000)]
+
+    graph = Graph.graph_from_iter('input').map(ops.Product(['a', 'b']))
+
+    assert expected == list(graph.run(input=lambda: iter(data)))
+
+
+def test_graph_map_subclassed_batch_mapper():
+    class Positive(ops.Filter):
+        def __call__(self, row: ops.TRow) -> ops.TRowsGenerator:
+            if row['a'] > 0:
+                yield from super().__call__(row)
+
+    data = [{'a': -1}, {'a': 2}, {'a': 3}]
+
+    graph = Graph.graph_from_iter('input').map(Positive(lambda row: row['a'] != 3))
+
+    assert [{'a': 2}] == list(graph.run(input=lambda: iter(data)))
+    assert list(ops.Map(Positive(lambda row: row['a'] != 3))(data)) == list(graph.run(input=lambda: iter(data)))
+
+
+def test_graph_map_subclassed_row_mapper():
+    class SafeLog(ops.Log):
+        def __call__(self, row: ops.TRow) -> ops.TRowsGenerator:
+            if row['x'] > 0:
+                yield from super().__call__(row)
+
+    data = [{'x': -1.0}, {'x': 1.0}]
+
+    graph = Graph.graph_from_iter('input').map(SafeLog('x', 'log'))
+
+    assert [{'x': 1.0, 'log': 0.0}] == list(graph.run(input=lambda: iter(data)))
+
+
 def test_graph_reduce():
     data = [
         {'a': 1, 'b': 1},
@@ -224,6 +280,22 @@ def test_graph_sort():
     assert expected == list(graph.run(input=lambda: iter(data)))
 
 
+def test_graph_sort_repeated_keys():
+    data = [{'word': 'abc'[i % 3], 'i': i} for i in range(3000)]
+    expected = sorted(data, key=lambda row: row['word'])
+
+    graph = Graph.graph_from_iter('input').sort(['word'])
+    assert expected == list(graph.run(input=lambda: iter(data)))
+
+
+def test_graph_sort_spilled_runs():
+    data = [{'word': 'abc'[i * 7 % 3], 'i': i} for i in range(5000)]
+    expected = sorted(data, key=lambda row: row['word'])
+
+    graph = Graph.graph_from_iter('input').sort(['word'], run_size=700)
+    assert expected == list(graph.run(input=lambda: iter(data)))
+
+
 def test_graph_join():
     data_1 = [
         {'id': 1, 'speed': 5},
@@ -248,6 +320,168 @@ def test_graph_join():
     assert expected == list(graph.run(input_1=lambda: iter(data_1), input_2=lambda: iter(data_2)))
 
 
+def test_graph_join_parallel():
+    data_1 = [{'id': i, 'speed': i * 2} for i in range(5000)]
+    data_2 = [{'id': i, 'cost': i * 3} for i in range(5000)]
+    expected = [{'id': i, 'speed': i * 2, 'cost': i * 3} for i in range(5000)]
+
+    graph_1 = Graph.graph_from_iter('input_1').sort(['id'])
+    graph_2 = Graph.graph_from_iter('input_2').sort(['id'])
+
+    graph = graph_1.join(ops.InnerJoiner(), graph_2, ['id'])
+    assert expected == list(graph.run_parallel(input_1=lambda: iter(data_1), input_2=lambda: iter(data_2)))
+
+
+def test_graph_run_parallel_without_fork(monkeypatch: tp.Any) -> None:
+    data_1 = [{'id': i, 'speed': i * 2} for i in range(100)]
+    data_2 = [{'id': i, 'cost': i * 3} for i in range(100)]
+    expected = [{'id': i, 'speed': i * 2, 'cost': i * 3} for i in range(100)]
+
+    monkeypatch.setattr(graph_module, '_FORK_CONTEXT', None)
+    graph = Graph.graph_from_iter('input_1').join(ops.InnerJoiner(), Graph.graph_from_iter('input_2'), ['id'])
+    assert expected == list(graph.run_parallel(input_1=lambda: iter(data_1), input_2=lambda: iter(data_2)))
+
+
+def test_graph_broadcast():
+    data = [
+        {'id': 1, 'speed': 5},
+        {'id': 3, 'speed': 10},
+        {'id': 2, 'speed': -1}
+    ]
+    expected = [
+        {'id': 1, 'speed': 5, 'n': 3},
+        {'id': 3, 'speed': 10, 'n': 3},
+        {'id': 2, 'speed': -1, 'n': 3}
+    ]
+
+    graph = Graph.graph_from_iter('input')
+    count = Graph.graph_from_iter('input').reduce(ops.Count('n'), [])
+
+    assert expected == list(graph.broadcast(count).run(input=lambda: iter(data)))
+    assert expected == list(graph.broadcast(count).run_parallel(input=lambda: iter(data)))
+
+
+def test_graph_cache_interleaved_branches():
+    # cached rows spill past the in-memory part and are read by both sides of the join at the same time
+    data = [{'k': i, 'v': i} for i in range(20000)]
+    expected = [{'k': i, 'v_1': i, 'v_2': i, 'w': i * i} for i in range(20000)]
+
+    docs = Graph.graph_from_iter('input').cache()
+    graph = docs.join(ops.InnerJoiner(), docs.map(ops.Product(['v', 'v'], 'w')), ['k'])
+    assert expected == list(graph.run(input=lambda: iter(data)))
+
+
+def test_graph_hash_reduce():
+    data = [
+        {'a': 2, 'b': 'y', 'c': 1},
+        {'a': 1, 'b': 'x', 'c': 2},
+        {'a': 2, 'b': 'y', 'c': 3},
+        {'a': 1, 'b': 'z', 'c': 4}
+    ]
+
+    repeated = data * 3
+    unique = [{'a': i * 7 % 5000, 'b': 'x', 'c': i} for i in range(5000)]
+
+    class TruthyCount(ops.Count):
+        def __call__(self, group_key: tp.Tuple[str, ...], rows: ops.TRowsIterable) -> ops.TRowsGenerator:
+            yield from super().__call__(group_key, (row for row in rows if row['v']))
+
+    falsy = [{'a': 1, 'v': 1}, {'a': 1, 'v': 0}, {'a': 1, 'v': None}] * 2
+
+    graph = Graph.graph_from_iter('input')
+    for rows, reducer, keys in [(data, ops.Count('n'), ['a']), (repeated, ops.Count('n'), ['a', 'b']),
+                                (repeated, ops.Sum('c'), ['a', 'b']), (data, ops.TermFrequency('b'), ['a']),
+                                (data, ops.FirstReducer(), ['a']), (falsy, TruthyCount('n'), ['a']),
+                                (unique, ops.Count('n'), ['a']),
+                                (unique, ops.TopN('c', 1), ['b'])]:
+        expected = graph.sort(keys).reduce(reducer, keys).run(input=lambda: iter(copy.deepcopy(rows)))
+        result = graph.hash_reduce(reducer, keys).run(input=lambda: iter(copy.deepcopy(rows)))
+        assert sorted(map(repr, expected)) == sorted(map(repr, result))
+
+
+def test_graph_hash_reduce_without_keys():
+    data = [{'a': 2}, {'a': 1}, {'a': 2}]
+
+    graph = Graph.graph_from_iter('input').hash_reduce(ops.Count('n'), [])
+
+    assert [{'n': 3}] == list(graph.run(input=lambda: iter(data)))
+
+
+def test_graph_cache():
+    data = [
+        {'doc_id': 1, 'text': 'a b'},
+        {'doc_id': 2, 'text': 'a'}
+    ]
+    expected = [
+        {'doc_id': 1, 'text': 'a', 'n': 2},
+        {'doc_id': 1, 'text': 'b', 'n': 2},
+        {'doc_id': 2, 'text': 'a', 'n': 2}
+    ]
+    calls = []
+
+    def source() -> tp.Iterator[ops.TRow]:
+        calls.append(1)
+        return iter(copy.deepcopy(data))
+
+    docs = Graph.graph_from_iter('input').cache()
+    count = docs.map(ops.Project(['doc_id'], inplace=True)).reduce(ops.Count('n'), [])
+    graph = docs.map(ops.Split('text')).broadcast(count)
+
+    assert expected == list(graph.run(input=source))
+    assert len(calls) == 1
+
+
+def test_graph_from_file_cache(tmp_path: tp.Any) -> None:
+    path = tmp_path / 'input.txt'
+    path.write_text('1\n2\n')
+    calls = []
+
+    def parser(line: str) -> ops.TRow:
+        calls.append(line)
+        return {'a': int(line)}
+
+    graph_1 = Graph.graph_from_file(str(path), parser, cache=True)
+    graph_2 = Graph.graph_from_file(str(path), parser, cache=True).map(ops.Product(['a', 'a'], 'b'))
+    assert [{'a': 1}, {'a': 2}] == list(graph_1.run())
+    assert [{'a': 1, 'b': 1}, {'a': 2, 'b': 4}] == list(graph_2.run())
+    assert [{'a': 1}, {'a': 2}] == list(graph_1.run())
+    assert len(calls) == 2
+
+    path.write_text('3\n')
+    os.utime(path, (0, 0))
+    assert [{'a': 3}] == list(graph_1.run())
+
+
+def test_graph_from_file_cache_join(tmp_path: tp.Any, monkeypatch: tp.Any) -> None:
+    # file rows spill past the in-memory part of the cache and are read by both sides of the join
+    path = tmp_path / 'input.txt'
+    path.write_text(''.join(f'{i}\n' for i in range(10000)))
+    calls = []
+
+    def parser(line: str) -> ops.TRow:
+        calls.append(line)
+        return {'a': int(line)}
+
+    expected = [{'a': i, 'b': i * i} for i in range(10000)]
+    graph = Graph.graph_from_file(str(path), parser, cache=True) \
+        .join(ops.InnerJoiner(), Graph.graph_from_file(str(path), parser, cache=True)
+              .map(ops.Product(['a', 'a'], 'b')), ['a'])
+    assert expected == list(graph.run())
+    assert expected == list(graph.run_parallel())
+    assert len(calls) == 10000
+
+    Graph.clear_file_cache()
+    assert expected == list(graph.run())
+    assert len(calls) == 20000
+
+    other_path = tmp_path / 'other.txt'
+    other_path.write_text('1\n')
+    monkeypatch.setattr(graph_module, 'FILE_CACHE_SIZE', 1)
+    assert [{'a': 1}] == list(Graph.graph_from_file(str(other_path), parser, cache=True).run())
+    assert expected == list(graph.run())
+    assert len(calls) == 30001
+
+
 def test_multiple_call() -> None:
     data_1 = [
         {'a': 1, 'b': 1},